@@ -1,5 +1,8 @@
+import concurrent.futures
+import itertools
 import json
-from bs4 import BeautifulSoup
+import os
+import re
 
 try:
     from utils import (
@@ -12,6 +15,7 @@ try:
         get_argentina_financial_indicators,
         process_raw_xlsx_to_tsv,
         PLAZO_LIQ_CERO,
+        REQUIRED_REPORT_COLS,
         download_cafci_xlsx,
         fix_missing_t0,
     )
@@ -34,186 +38,108 @@ ID_BASE_SUFFIX = "base"
 ID_BENCHMARK = "benchmarkGarantizado"
 ID_FINANCIAL_DATA = "datosFinancieros"
 
-# Define the combinations of filters and their corresponding ID parts
+# Patterns that match previously generated data scripts. The tags are
+# authored by create_script_tag and guaranteed well-formed, so they can be
+# stripped and re-spliced as text without parsing the whole document.
+OLD_DATA_SCRIPT_RE = re.compile(
+    rf'<script[^>]*class="{SCRIPT_CLASS_DATA}"[^>]*>.*?</script>\s*', re.S
+)
+OLD_ID_SCRIPT_RE = re.compile(
+    rf'<script[^>]*id="(?:{ID_BENCHMARK}|{ID_FINANCIAL_DATA})"[^>]*>.*?</script>\s*',
+    re.S,
+)
+BODY_CLOSE_TAG = "</body>"
+
+# The combinations are the Cartesian product of four boolean flags.
+# itertools.product in (sa, ytd, mm, usd) order reproduces the original
+# hand-written list exactly, script IDs included; the ytd bit maps to
+# periodo 2 (YTD sort column) vs. periodo 0 (daily).
+FILTER_FLAG_IDS = ["sa", "ytd", "mm", "usd"]
 FILTER_COMBINATIONS = [
-    # (filter_clase_a, use_ytd, filter_mm, filter_usd), id_suffix_parts
-    {
-        "flags": {
-            "filter_clase_a": False,
-            "periodo": 0,
-            "filter_mm": False,
-            "filter_usd": False,
-        },
-        "id_parts": [],
-    },
-    {
-        "flags": {
-            "filter_clase_a": False,
-            "periodo": 0,
-            "filter_mm": False,
-            "filter_usd": True,
-        },
-        "id_parts": ["usd"],
-    },
-    {
-        "flags": {
-            "filter_clase_a": False,
-            "periodo": 0,
-            "filter_mm": True,
-            "filter_usd": False,
-        },
-        "id_parts": ["mm"],
-    },
     {
         "flags": {
-            "filter_clase_a": False,
-            "periodo": 0,
-            "filter_mm": True,
-            "filter_usd": True,
+            "filter_clase_a": sa,
+            "periodo": 2 if ytd else 0,
+            "filter_mm": mm,
+            "filter_usd": usd,
         },
-        "id_parts": ["mm", "usd"],
-    },  # Note: Original code didn't filter MM and USD together on Plazo 0? Added for completeness. Review if needed.
-    {
-        "flags": {
-            "filter_clase_a": False,
-            "periodo": 2,
-            "filter_mm": False,
-            "filter_usd": False,
-        },
-        "id_parts": ["ytd"],
-    },
-    {
-        "flags": {
-            "filter_clase_a": False,
-            "periodo": 2,
-            "filter_mm": False,
-            "filter_usd": True,
-        },
-        "id_parts": ["ytd", "usd"],
-    },
-    {
-        "flags": {
-            "filter_clase_a": False,
-            "periodo": 2,
-            "filter_mm": True,
-            "filter_usd": False,
-        },
-        "id_parts": ["ytd", "mm"],
-    },
-    {
-        "flags": {
-            "filter_clase_a": False,
-            "periodo": 2,
-            "filter_mm": True,
-            "filter_usd": True,
-        },
-        "id_parts": ["ytd", "mm", "usd"],
-    },  # As above
-    {
-        "flags": {
-            "filter_clase_a": True,
-            "periodo": 0,
-            "filter_mm": False,
-            "filter_usd": False,
-        },
-        "id_parts": ["sa"],
-    },
-    {
-        "flags": {
-            "filter_clase_a": True,
-            "periodo": 0,
-            "filter_mm": False,
-            "filter_usd": True,
-        },
-        "id_parts": ["sa", "usd"],
-    },
-    {
-        "flags": {
-            "filter_clase_a": True,
-            "periodo": 0,
-            "filter_mm": True,
-            "filter_usd": False,
-        },
-        "id_parts": ["sa", "mm"],
-    },
-    {
-        "flags": {
-            "filter_clase_a": True,
-            "periodo": 0,
-            "filter_mm": True,
-            "filter_usd": True,
-        },
-        "id_parts": ["sa", "mm", "usd"],
-    },  # As above
-    {
-        "flags": {
-            "filter_clase_a": True,
-            "periodo": 2,
-            "filter_mm": False,
-            "filter_usd": False,
-        },
-        "id_parts": ["sa", "ytd"],
-    },
-    {
-        "flags": {
-            "filter_clase_a": True,
-            "periodo": 2,
-            "filter_mm": False,
-            "filter_usd": True,
-        },
-        "id_parts": ["sa", "ytd", "usd"],
-    },
-    {
-        "flags": {
-            "filter_clase_a": True,
-            "periodo": 2,
-            "filter_mm": True,
-            "filter_usd": False,
-        },
-        "id_parts": ["sa", "ytd", "mm"],
-    },
-    {
-        "flags": {
-            "filter_clase_a": True,
-            "periodo": 2,
-            "filter_mm": True,
-            "filter_usd": True,
-        },
-        "id_parts": ["sa", "ytd", "mm", "usd"],
-    },  # As above
+        "id_parts": [
+            part
+            for part, active in zip(FILTER_FLAG_IDS, (sa, ytd, mm, usd))
+            if active
+        ],
+    }
+    for sa, ytd, mm, usd in itertools.product((False, True), repeat=4)
 ]
 
 # --- Core Logic Functions ---
 
 
-def generate_fci_json_for_combination(filter_clase_a, periodo, filter_mm, filter_usd):
+def load_prepared_base_frames():
+    """
+    Loads and prepares the two base dataframes (with and without the
+    'Clase A' filter) exactly once. Every filter combination reuses these,
+    so the TSV read, dtype coercion and fix_missing_t0 scan run twice
+    instead of sixteen times.
+    """
+    prepared_frames = {}
+    for filter_clase_a in (False, True):
+        df = load_prepared_fci_data(filter_clase_a=filter_clase_a)
+        # Validate the report columns once per frame, not per combination
+        missing_cols = [col for col in REQUIRED_REPORT_COLS if col not in df.columns]
+        if missing_cols and not df.empty:
+            print(
+                f"Warning: Missing columns for top performance analysis: {missing_cols}"
+            )
+            df = df.iloc[0:0]
+        if not df.empty:
+            df = fix_missing_t0(df)
+            # Apply mandatory Plazo Liq = 0 filter (based on original script structure)
+            df = filter_by_plazo_liq(df, plazos_allowed={PLAZO_LIQ_CERO})
+        prepared_frames[filter_clase_a] = df
+    return prepared_frames
+
+
+def build_filtered_frames(prepared_frames):
     """
-    Loads data, applies filters based on flags, and returns top 10 funds as JSON.
+    Materializes the (filter_clase_a, filter_mm, filter_usd) filter lattice.
 
-    Note: This function implicitly filters for Plazo Liq = 0 based on the
-          original script's logic within the loop structure.
-          It also assumes base data loading handles 'Clase A' filtering if needed.
+    The 16 combinations only differ by these three row filters plus the
+    periodo flag, and periodo merely picks the sort column. Building the
+    8 distinct frames up front means each mm/usd boolean mask runs at
+    most once per base frame instead of once per combination.
+    """
+    filtered_frames = {}
+    for filter_clase_a, base_df in prepared_frames.items():
+        for filter_mm in (False, True):
+            df_mm = (
+                filter_by_money_market(base_df, include_mm=True)
+                if filter_mm and not base_df.empty
+                else base_df
+            )
+            for filter_usd in (False, True):
+                df_combo = (
+                    filter_by_currency(df_mm)
+                    if filter_usd and not df_mm.empty
+                    else df_mm
+                )  # Assumes default USD currencies from base_refactored
+                filtered_frames[(filter_clase_a, filter_mm, filter_usd)] = df_combo
+    return filtered_frames
+
+
+def generate_fci_json_for_combination(df, periodo):
+    """
+    Returns the top 10 funds of an already-filtered dataframe as records.
+
+    Note: The frame is expected to already carry the Plazo Liq = 0,
+          'Clase A' and mm/usd filtering from the shared frame lattice.
           The df_min filter from the original code is omitted as it was commented out.
     """
-    # Load base data - applying 'Clase A' filter here if specified
-    df = load_prepared_fci_data(filter_clase_a=filter_clase_a)
     if df.empty:
-        return json.dumps([])  # Return empty list if loading failed
-    df = fix_missing_t0(df)
-    # Apply mandatory Plazo Liq = 0 filter (based on original script structure)
-    df = filter_by_plazo_liq(df, plazos_allowed={PLAZO_LIQ_CERO})
-
-    # Apply conditional filters
-    if filter_mm:
-        df = filter_by_money_market(df, include_mm=True)
-    if filter_usd:
-        df = filter_by_currency(
-            df
-        )  # Assumes default USD currencies from base_refactored
+        return []  # Return empty list if loading failed
 
     # Get top 10 based on YTD flag
-    top_10_json = get_top_performing_funds(df, periodo=periodo)
-    return top_10_json
+    return get_top_performing_funds(df, periodo=periodo)
 
 
 # Potential Migration Candidate:
@@ -227,8 +153,8 @@ def generate_fci_json_for_combination(filter_clase_a, periodo, filter_mm, filter
 def create_script_tag(tag_id, json_data, script_type=SCRIPT_TYPE, css_class=None):
     """Creates an HTML script tag string with the given ID and JSON data."""
     class_attribute = f' class="{css_class}"' if css_class else ""
-    # Use json.dumps for proper JSON formatting within the script tag
-    json_string = json.dumps(json_data, indent=2, ensure_ascii=False)
+    # Single serialization pass; no indent since the file is machine-read
+    json_string = json.dumps(json_data, ensure_ascii=False)
     return f'<script type="{script_type}" id="{tag_id}"{class_attribute}>\n{json_string}\n</script>\n'
 
 
@@ -250,40 +176,48 @@ def update_html_with_json_data(html_path=HTML_FILENAME):
         print(f"Error reading HTML file '{html_path}': {e}")
         return
 
-    # 3. Parse HTML and find body
-    soup = BeautifulSoup(html_content, "html.parser")
-    body = soup.find("body")
-    if not body:
-        print(f"Error: No <body> tag found in '{html_path}'. Cannot proceed.")
-        return
-
-    # 4. Remove old data script tags
+    # 3. Remove old data script tags (textual, no DOM parse needed)
     print(
         f"Removing old script tags with type='{SCRIPT_TYPE}' and class='{SCRIPT_CLASS_DATA}'..."
     )
-    removed_count = 0
-    for old_script in body.find_all(
-        "script", type=SCRIPT_TYPE, class_=SCRIPT_CLASS_DATA
-    ):
-        print(f"  Removing script with ID: {old_script.get('id', 'N/A')}")
-        old_script.decompose()
-        removed_count += 1
+    html_content, removed_count = OLD_DATA_SCRIPT_RE.subn("", html_content)
     # Also remove specific benchmark/financial data scripts by ID if they might exist without the class
-    for specific_id in [ID_BENCHMARK, ID_FINANCIAL_DATA]:
-        script_to_remove = body.find("script", id=specific_id)
-        if script_to_remove:
-            print(f"  Removing script with ID: {specific_id}")
-            script_to_remove.decompose()
-            removed_count += 1
+    html_content, removed_by_id = OLD_ID_SCRIPT_RE.subn("", html_content)
+    removed_count += removed_by_id
     print(f"Removed {removed_count} old script tag(s).")
 
+    # 4. Locate the insertion point before the closing body tag
+    body_close_idx = html_content.rfind(BODY_CLOSE_TAG)
+    if body_close_idx == -1:
+        print(f"Error: No {BODY_CLOSE_TAG} tag found in '{html_path}'. Cannot proceed.")
+        return
+
     # 5. Generate new script tags
     print("Generating new data script tags...")
-    new_scripts_html_string = ""
+    # Collect tag strings and join once; repeated += is quadratic
+    new_scripts_parts = []
+
+    # Prepare the two base frames once and expand the shared filter lattice
+    prepared_frames = load_prepared_base_frames()
+    filtered_frames = build_filtered_frames(prepared_frames)
 
-    # Generate FCI combination scripts
-    for combo in FILTER_COMBINATIONS:
+    def generate_combo_data(combo):
         flags = combo["flags"]
+        df = filtered_frames[
+            (flags["filter_clase_a"], flags["filter_mm"], flags["filter_usd"])
+        ]
+        return generate_fci_json_for_combination(df, periodo=flags["periodo"])
+
+    # The combinations are independent mask/sort/serialize jobs and pandas
+    # releases the GIL for most of them, so a thread pool scales well.
+    # The network-bound benchmark/indicator fetches overlap with that work.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        benchmark_future = executor.submit(get_benchmark_remunerated_accounts)
+        financial_future = executor.submit(get_argentina_financial_indicators)
+        combo_results = list(executor.map(generate_combo_data, FILTER_COMBINATIONS))
+
+    # Build the script tags sequentially in combination order
+    for combo, json_data in zip(FILTER_COMBINATIONS, combo_results):
         id_parts = combo["id_parts"]
 
         if not id_parts:
@@ -291,52 +225,46 @@ def update_html_with_json_data(html_path=HTML_FILENAME):
         else:
             script_id = ID_PREFIX + "_".join(id_parts)
 
-        print(f"  Generating data for ID: {script_id}...")
-        # Generate JSON string using the dedicated function
-        json_string = generate_fci_json_for_combination(**flags)
-        # Create the script tag HTML - use json.loads then json.dumps for consistent formatting
-        try:
-            json_data_obj = json.loads(json_string)
-            script_tag_html = create_script_tag(
-                script_id, json_data_obj, css_class=SCRIPT_CLASS_DATA
-            )
-            new_scripts_html_string += script_tag_html
-            print(f"    Generated script tag for ID: {script_id}")
-        except json.JSONDecodeError:
-            print(
-                f"    Warning: Could not decode JSON for ID {script_id}. Skipping script tag."
-            )
+        script_tag_html = create_script_tag(
+            script_id, json_data, css_class=SCRIPT_CLASS_DATA
+        )
+        new_scripts_parts.append(script_tag_html)
+        print(f"    Generated script tag for ID: {script_id}")
 
     # Generate Benchmark script
     print(f"  Generating data for ID: {ID_BENCHMARK}...")
-    benchmark_data = get_benchmark_remunerated_accounts()
+    benchmark_data = benchmark_future.result()
     script_tag_html = create_script_tag(
         ID_BENCHMARK, benchmark_data
     )  # No class needed? Add if required.
-    new_scripts_html_string += script_tag_html
+    new_scripts_parts.append(script_tag_html)
     print(f"    Generated script tag for ID: {ID_BENCHMARK}")
 
     # Generate Financial Data script
     print(f"  Generating data for ID: {ID_FINANCIAL_DATA}...")
-    financial_data = get_argentina_financial_indicators()
+    financial_data = financial_future.result()
     script_tag_html = create_script_tag(
         ID_FINANCIAL_DATA, financial_data
     )  # No class needed? Add if required.
-    new_scripts_html_string += script_tag_html
+    new_scripts_parts.append(script_tag_html)
     print(f"    Generated script tag for ID: {ID_FINANCIAL_DATA}")
 
-    # 6. Append new scripts to HTML body
+    # 6. Splice new scripts into the HTML right before </body>
     print("Appending new script tags to HTML body...")
-    new_scripts_soup = BeautifulSoup(new_scripts_html_string, "html.parser")
-    # Iterate through the parsed tags and append them
-    for new_tag in new_scripts_soup.find_all("script"):
-        body.append(new_tag)
+    new_scripts_html_string = "".join(new_scripts_parts)
+    final_html = (
+        html_content[:body_close_idx]
+        + new_scripts_html_string
+        + html_content[body_close_idx:]
+    )
 
-    # 7. Write updated HTML back to file
+    # 7. Write updated HTML back to file (single buffered write, then an
+    #    atomic rename so a static server never reads a half-written file)
+    tmp_path = html_path + ".tmp"
     try:
-        with open(html_path, "w", encoding=HTML_ENCODING) as f:
-            # Use prettify to maintain readable HTML structure
-            f.write(soup.prettify(formatter="html5"))
+        with open(tmp_path, "w", encoding=HTML_ENCODING, buffering=1 << 20) as f:
+            f.write(final_html)
+        os.replace(tmp_path, html_path)
         print(f"Successfully updated '{html_path}' with new data scripts.")
     except IOError as e:
         print(f"Error writing updated HTML file '{html_path}': {e}")
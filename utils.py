@@ -1,13 +1,18 @@
+import concurrent.futures
 import datetime
+import email.utils
 import functools
 import logging
 
-from fredapi import Fred
 import os
+import shutil
 import time
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
 
 
 # --- Configuration & Constants ---
@@ -25,6 +30,8 @@ COL_MINIMO_INV = "Mínimo de Inversión_Mínimo de Inversión"
 COL_VARIACION_MENSUAL = "Variacion cuotaparte %_30/04/25"
 COL_VARIACION_DIARIA = "Variac. %"
 COL_VARIACION_YTD_REF = "30/12/24"  # Consider renaming if date changes
+COL_CODIGO_CAFCI = "Código CAFCI_Código CAFCI"
+COL_CAFCI_STR = "_cafci_str"  # string view of Código CAFCI, cached at load
 
 # Filtering Constants
 FONDOS_PLAZO_CERO_MODIFICAR = [
@@ -41,6 +48,18 @@ MONEY_MARKET_CODE = 3
 DEFAULT_CLASSIFICATION_CODE = 100
 TOP_N_COUNT = 10
 
+# Columns the top-performers report needs; callers should validate these
+# once per prepared frame rather than per filter combination.
+REQUIRED_REPORT_COLS = [
+    COL_FONDO,
+    COL_VARIACION_DIARIA,
+    COL_VARIACION_MENSUAL,
+    COL_VARIACION_YTD_REF,
+    COL_MONEDA_FONDO,
+    COL_CODIGO_CLAS,
+    COL_MINIMO_INV,
+]
+
 # Financial Calculation Constants
 DAYS_IN_YEAR = 365
 DAYS_IN_MONTH = 30
@@ -48,12 +67,25 @@ DAYS_IN_MONTH = 30
 # API Configuration
 FRED_API_KEY = os.getenv("FRED_API_KEY")
 FRED_SERIES_CPI_US = "CPIAUCSL"
+URL_FRED_OBSERVATIONS = "https://api.stlouisfed.org/fred/series/observations"
 URL_ARG_DATOS_UVA = "https://api.argentinadatos.com/v1/finanzas/indices/uva"
 URL_ARG_DATOS_DOLAR = "https://api.argentinadatos.com/v1/cotizaciones/dolares"
 API_DATE_REF_START_YEAR = (
     "2024-12-31"  # Based on original code '30/12/24' logic for YTD
 )
 
+# Shared HTTP session: keep-alive + pooled connections amortize the TCP/TLS
+# handshake across the CAFCI, PPI and indicator API calls.
+_SESSION = requests.Session()
+_SESSION.headers.update({"Accept-Encoding": "gzip"})
+_http_adapter = HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+)
+_SESSION.mount("https://", _http_adapter)
+_SESSION.mount("http://", _http_adapter)
+
 # API Data Keys
 API_KEY_FECHA = "fecha"
 API_KEY_VALOR = "valor"
@@ -99,8 +131,16 @@ BENCHMARK_OPCIONES_CAR = [
 
 
 def process_raw_xlsx_to_tsv(input_path=FCI_XLSX_PATH, output_path=FCI_TSV_PATH):
+    # Skip the expensive re-parse when the TSV is already newer than the XLSX
+    if (
+        os.path.exists(input_path)
+        and os.path.exists(output_path)
+        and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    ):
+        print(f"'{output_path}' is up to date with '{input_path}'; skipping.")
+        return
     try:
-        df = pd.read_excel(input_path, header=None)
+        df = pd.read_excel(input_path, header=None, engine="calamine")
         header_top_idx = df[df.eq("Fondo").any(axis=1)].index[0]
         header_df = df.iloc[header_top_idx: header_top_idx + 2].copy().ffill(axis=0)
         combined_headers = (
@@ -141,39 +181,76 @@ def load_prepared_fci_data(
             mask_modificar = df.iloc[:, 0].isin(FONDOS_PLAZO_CERO_MODIFICAR)
             df.loc[mask_modificar, COL_PLAZO_LIQ] = 0  # Assuming 0 should be numeric
         if filter_clase_a:
-            condicion_clase_a = (
-                df[COL_FONDO].str.contains(CLASE_GENERIC_STR, na=False)
-            ) & (df[COL_FONDO].str.contains(CLASE_A_STR, na=False))
-            condicion_sin_clase = ~df[COL_FONDO].str.contains(
-                CLASE_GENERIC_STR, na=False
+            # Compute the generic 'Clase' scan once and reuse it for both sides
+            tiene_clase = df[COL_FONDO].str.contains(CLASE_GENERIC_STR, na=False)
+            condicion_clase_a = tiene_clase & df[COL_FONDO].str.contains(
+                CLASE_A_STR, na=False
+            )
+            df = df[condicion_clase_a | ~tiene_clase]
+
+        # Ensure correct types for filtering columns.
+        # Skip the string-cleanup path when pandas already parsed a numeric
+        # column, and use non-regex str ops (dispatched to C) otherwise.
+        if is_numeric_dtype(df[COL_MINIMO_INV]):
+            df[COL_MINIMO_INV] = df[COL_MINIMO_INV].fillna(0).astype("int32")
+        else:
+            # Keep only the integer part (drop everything after '.' or ',')
+            minimo_limpio = (
+                df[COL_MINIMO_INV]
+                .astype(str)
+                .str.split(".", n=1)
+                .str[0]
+                .str.split(",", n=1)
+                .str[0]
+            )
+            df[COL_MINIMO_INV] = (
+                pd.to_numeric(minimo_limpio, errors="coerce").fillna(0).astype("int32")
             )
-            df = df[condicion_clase_a | condicion_sin_clase]
-
-        # Ensure correct types for filtering columns
-        df[COL_MINIMO_INV] = (
-            df[COL_MINIMO_INV]
-            .astype(str)
-            .str.replace(r"[\.,].*$", "", regex=True)
-            .fillna("0")
-        )
-        df[COL_MINIMO_INV] = (
-            pd.to_numeric(df[COL_MINIMO_INV], errors="coerce").fillna(0).astype(int)
-        )
 
-        df[COL_PLAZO_LIQ] = df[COL_PLAZO_LIQ].astype(
-            str
-        )  # Keep as string for filtering '0', '1'
+        # Keep plazo as string values but categorical dtype: only a handful
+        # of distinct plazos exist, so isin compares integer codes. '0' is
+        # forced into the categories because fix_missing_t0 may assign it.
+        plazos_str = df[COL_PLAZO_LIQ].astype(str)
+        df[COL_PLAZO_LIQ] = pd.Categorical(
+            plazos_str, categories=sorted(set(plazos_str.unique()) | {PLAZO_LIQ_CERO})
+        )
 
+        if not is_numeric_dtype(df[COL_CODIGO_CLAS]):
+            df[COL_CODIGO_CLAS] = (
+                df[COL_CODIGO_CLAS]
+                .astype(str)
+                .str.replace(",", "", regex=False)
+                .str.replace('"', "", regex=False)
+                .str.replace(" ", "", regex=False)
+            )
+            df[COL_CODIGO_CLAS] = pd.to_numeric(df[COL_CODIGO_CLAS], errors="coerce")
         df[COL_CODIGO_CLAS] = (
-            df[COL_CODIGO_CLAS].astype(str).str.replace(r'[," ]', "", regex=True)
+            df[COL_CODIGO_CLAS].fillna(DEFAULT_CLASSIFICATION_CODE).astype("int32")
         )
-        df[COL_CODIGO_CLAS] = (
-            pd.to_numeric(df[COL_CODIGO_CLAS], errors="coerce")
-            .fillna(DEFAULT_CLASSIFICATION_CODE)
-            .astype(int)
+
+        df[COL_MONEDA_FONDO] = (
+            df[COL_MONEDA_FONDO].fillna("").astype(str).astype("category")
         )
 
-        df[COL_MONEDA_FONDO] = df[COL_MONEDA_FONDO].fillna("").astype(str)
+        # Coerce the performance columns once here; they are invariant
+        # across the filter combinations, so doing it per top-N call
+        # repeated the same work sixteen times
+        for col_rendimiento in (
+            COL_VARIACION_DIARIA,
+            COL_VARIACION_MENSUAL,
+            COL_VARIACION_YTD_REF,
+        ):
+            if col_rendimiento in df.columns and not is_numeric_dtype(
+                df[col_rendimiento]
+            ):
+                df[col_rendimiento] = pd.to_numeric(
+                    df[col_rendimiento], errors="coerce"
+                )
+
+        if COL_CODIGO_CAFCI in df.columns:
+            # Cache the string form once so fix_missing_t0 never re-casts
+            # the whole column per call
+            df[COL_CAFCI_STR] = df[COL_CODIGO_CAFCI].astype(str)
 
         return df
 
@@ -192,8 +269,9 @@ def filter_by_plazo_liq(df, plazos_allowed=PLAZOS_LIQ_PERMITIDOS):
     if COL_PLAZO_LIQ not in df.columns:
         print(f"Warning: Column '{COL_PLAZO_LIQ}' not found for filtering.")
         return df
-    mask = df[COL_PLAZO_LIQ].astype(str).isin(plazos_allowed)
-    return df[mask].copy()
+    # load_prepared_fci_data guarantees string values (categorical dtype)
+    mask = df[COL_PLAZO_LIQ].isin(plazos_allowed)
+    return df[mask]
 
 
 def filter_by_currency(df, currencies=CURRENCIES_USD):
@@ -201,7 +279,7 @@ def filter_by_currency(df, currencies=CURRENCIES_USD):
         print(f"Warning: Column '{COL_MONEDA_FONDO}' not found for filtering.")
         return df
     mask = df[COL_MONEDA_FONDO].isin(currencies)
-    return df[mask].copy()
+    return df[mask]
 
 
 def filter_by_money_market(df, include_mm=True):
@@ -213,7 +291,7 @@ def filter_by_money_market(df, include_mm=True):
         mask = df[COL_CODIGO_CLAS] == MONEY_MARKET_CODE
     else:
         mask = df[COL_CODIGO_CLAS] != MONEY_MARKET_CODE
-    return df[mask].copy()
+    return df[mask]
 
 
 # --- Analysis and Reporting Functions ---
@@ -224,36 +302,25 @@ def get_top_performing_funds(df, n=TOP_N_COUNT, periodo=0):
         performance_col = COL_VARIACION_MENSUAL
     if periodo == 2:
         performance_col = COL_VARIACION_YTD_REF
-    required_cols = [
-        COL_FONDO,
-        COL_VARIACION_DIARIA,
-        COL_VARIACION_MENSUAL,
-        COL_VARIACION_YTD_REF,
-        COL_MONEDA_FONDO,
-        COL_CODIGO_CLAS,
-        COL_MINIMO_INV,
-    ]
-
-    missing_cols = [col for col in required_cols if col not in df.columns]
-    if missing_cols:
-        print(f"Warning: Missing columns for top performance analysis: {missing_cols}")
-        return json.dumps([])  # Return empty JSON array
-
-    df_select = df[required_cols].copy()
 
-    if performance_col not in df_select.columns:
-        print(f"Warning: Performance column '{performance_col}' not found.")
-        return json.dumps([])
+    df_select = df[REQUIRED_REPORT_COLS].copy()
 
-    df_select[performance_col] = pd.to_numeric(
-        df_select[performance_col], errors="coerce"
-    )
+    # Load-time coercion already happened; only fall back for frames that
+    # didn't come through load_prepared_fci_data
+    if not is_numeric_dtype(df_select[performance_col]):
+        df_select[performance_col] = pd.to_numeric(
+            df_select[performance_col], errors="coerce"
+        )
     df_select.dropna(subset=[performance_col], inplace=True)
 
-    df_sorted = df_select.sort_values(by=performance_col, ascending=False)
-    top_n_df = df_sorted.head(n).copy()
+    # nlargest is an O(N log n) partial selection vs. a full O(N log N) sort
+    top_n_df = df_select.nlargest(n, performance_col)
 
-    return top_n_df.to_json(orient="records", force_ascii=False)
+    # The non-sorted performance columns can still carry NaN; map them to
+    # None so json.dumps emits valid null tokens like to_json used to
+    top_n_df = top_n_df.astype(object).where(top_n_df.notna(), None)
+
+    return top_n_df.to_dict(orient="records")
 
 
 def calculate_remunerated_account_metrics(
@@ -306,18 +373,36 @@ def get_us_ytd_inflation(series_id=FRED_SERIES_CPI_US, api_key=FRED_API_KEY):
         print("Error: FRED API key not configured.")
         return None
     try:
-        fred = Fred(api_key=api_key)
         current_year = datetime.datetime.now().year
         start_date = f"{current_year}-01-01"
 
-        cpi_data = fred.get_series(series_id, start_date=start_date)
+        # One pooled GET against the JSON endpoint; fredapi built a fresh
+        # session per call and parsed the series through pandas
+        response = _SESSION.get(
+            URL_FRED_OBSERVATIONS,
+            params={
+                "series_id": series_id,
+                "api_key": api_key,
+                "file_type": "json",
+                "observation_start": start_date,
+            },
+            timeout=10,
+        )
+        response.raise_for_status()
+        observations = orjson.loads(response.content).get("observations", [])
+
+        # FRED reports missing points as "."; keep only real values
+        cpi_data = [
+            float(obs["value"])
+            for obs in observations
+            if obs.get("value") not in (None, ".")
+        ]
 
-        if cpi_data is None or cpi_data.empty:
+        if not cpi_data:
             print(f"No data retrieved for series {series_id} starting {start_date}.")
             return None
 
         # Ensure we have data for the start and end of the period
-        cpi_data = cpi_data.dropna()
         if len(cpi_data) < 2:
             print(
                 f"Insufficient data points ({len(cpi_data)}) for YTD for series {series_id} in {current_year}."
@@ -326,8 +411,8 @@ def get_us_ytd_inflation(series_id=FRED_SERIES_CPI_US, api_key=FRED_API_KEY):
 
         # Use first available point in the year and the last available point
         month = (datetime.datetime.now().month - 1) * -1
-        cpi_start = cpi_data.iloc[month]
-        cpi_end = cpi_data.iloc[-1]
+        cpi_start = cpi_data[month]
+        cpi_end = cpi_data[-1]
 
         if cpi_start == 0:
             print(
@@ -345,13 +430,14 @@ def get_us_ytd_inflation(series_id=FRED_SERIES_CPI_US, api_key=FRED_API_KEY):
 
 def fetch_api_data(url):
     try:
-        response = requests.get(url, timeout=10)  # Add timeout
+        response = _SESSION.get(url, timeout=10)  # Add timeout
         response.raise_for_status()
-        return response.json()
+        # orjson parses the raw bytes 2-3x faster than response.json()
+        return orjson.loads(response.content)
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data from {url}: {e}")
         return None
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"Error decoding JSON from {url}: {e}")
         return None
 
@@ -362,22 +448,33 @@ def get_argentina_financial_indicators():
         today = datetime.date.today()
         yesterday_date_str = (today - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
 
+        # The three sources are independent and latency-bound; fetching them
+        # concurrently cuts wall time to roughly the slowest single call.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            future_us = executor.submit(get_us_ytd_inflation)
+            future_uva = executor.submit(fetch_api_data, URL_ARG_DATOS_UVA)
+            future_dolar = executor.submit(fetch_api_data, URL_ARG_DATOS_DOLAR)
+            us_inflation = future_us.result()
+            data_uva = future_uva.result()
+            data_dolar = future_dolar.result()
+
         # --- US Inflation (YTD) ---
-        us_inflation = get_us_ytd_inflation()
         results["inflacion_usa_ytd"] = (
             us_inflation if us_inflation is not None else "Error fetching"
         )
 
+        # Only two dates matter per series; a set makes each lookup O(1)
+        wanted_dates = {API_DATE_REF_START_YEAR, yesterday_date_str}
+
         # --- Argentina UVA Inflation ---
-        data_uva = fetch_api_data(URL_ARG_DATOS_UVA)
         if data_uva:
-            points_uva = {
-                item[API_KEY_FECHA]: item[API_KEY_VALOR]
-                for item in data_uva
-                if item.get(API_KEY_FECHA)
-                in [API_DATE_REF_START_YEAR, yesterday_date_str]
-                and item.get(API_KEY_VALOR) is not None
-            }
+            points_uva = {}
+            for item in data_uva:
+                fecha = item.get(API_KEY_FECHA)
+                if fecha in wanted_dates:
+                    valor = item.get(API_KEY_VALOR)
+                    if valor is not None:
+                        points_uva[fecha] = valor
 
             start_val_uva = points_uva.get(API_DATE_REF_START_YEAR)
             end_val_uva = points_uva.get(yesterday_date_str)
@@ -397,16 +494,16 @@ def get_argentina_financial_indicators():
             results["inflacion_uva"] = {"error": "Failed to fetch UVA data from API."}
 
         # --- Argentina Dolar Bolsa Variation ---
-        data_dolar = fetch_api_data(URL_ARG_DATOS_DOLAR)
         if data_dolar:
-            points_dolar = {
-                item[API_KEY_FECHA]: item[API_KEY_COMPRA]
-                for item in data_dolar
-                if item.get(API_KEY_CASA) == API_VALUE_CASA_BOLSA
-                and item.get(API_KEY_FECHA)
-                in [API_DATE_REF_START_YEAR, yesterday_date_str]
-                and item.get(API_KEY_COMPRA) is not None
-            }
+            points_dolar = {}
+            for item in data_dolar:
+                if item.get(API_KEY_CASA) != API_VALUE_CASA_BOLSA:
+                    continue
+                fecha = item.get(API_KEY_FECHA)
+                if fecha in wanted_dates:
+                    compra = item.get(API_KEY_COMPRA)
+                    if compra is not None:
+                        points_dolar[fecha] = compra
 
             start_val_dolar = points_dolar.get(API_DATE_REF_START_YEAR)
             end_val_dolar = points_dolar.get(yesterday_date_str)
@@ -441,13 +538,24 @@ def download_cafci_xlsx(output_filename="fci.xlsx"):
 
     print(f"Intentando descargar desde: {url}")
 
+    # GET condicional: si ya hay un archivo local, el servidor puede
+    # responder 304 y se evita la descarga (y el reproceso posterior)
+    request_headers = {}
+    if os.path.exists(output_filename):
+        request_headers["If-Modified-Since"] = email.utils.formatdate(
+            os.path.getmtime(output_filename), usegmt=True
+        )
+
     try:
-        response = requests.get(url, stream=True)
+        response = _SESSION.get(url, stream=True, headers=request_headers)
+        if response.status_code == 304:
+            print(f"{output_filename} sin cambios en el servidor (HTTP 304)")
+            return True
         response.raise_for_status()  # Lanza un HTTPError para respuestas de error (4xx o 5xx)
-        with open(output_filename, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        # copyfileobj con buffer grande copia en C, sin un write por chunk chico
+        response.raw.decode_content = True
+        with open(output_filename, "wb", buffering=1 << 20) as f:
+            shutil.copyfileobj(response.raw, f, length=1 << 20)
         print(f"Archivo descargado exitosamente y guardado como {output_filename}")
         return True
     except requests.exceptions.RequestException as e:
@@ -485,7 +593,7 @@ def actualizar_plazo_liquidacion_fci():
 
     isins_from_api = []
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = _SESSION.post(url, headers=headers, json=payload)
         response.raise_for_status()
         data = response.json()
 
@@ -498,18 +606,26 @@ def actualizar_plazo_liquidacion_fci():
     except requests.exceptions.RequestException as e:
         logging.error(e)
 
-    return isins_from_api
+    # frozenset: immutable (safe to share via the cache) and hash-based, so
+    # .isin() doesn't rebuild a set from a list on every call
+    return frozenset(isins_from_api)
 
 
 def fix_missing_t0(df):
     isins_from_api = actualizar_plazo_liquidacion_fci()
-    if (
-        isins_from_api
-        and "Código CAFCI_Código CAFCI" in df.columns
-        and "Plazo Liq._Plazo Liq." in df.columns
-    ):
-        rows_to_update = (
-            df["Código CAFCI_Código CAFCI"].astype(str).isin(isins_from_api)
+    if isins_from_api and COL_PLAZO_LIQ in df.columns:
+        if COL_CAFCI_STR in df.columns:
+            codigos_cafci = df[COL_CAFCI_STR]
+        elif COL_CODIGO_CAFCI in df.columns:
+            codigos_cafci = df[COL_CODIGO_CAFCI]
+            if codigos_cafci.dtype != object:
+                codigos_cafci = codigos_cafci.astype(str)
+        else:
+            return df
+        rows_to_update = codigos_cafci.isin(isins_from_api)
+        # assign + mask instead of in-place .loc: the incoming frame may be
+        # a shared view now that the filter helpers no longer copy
+        df = df.assign(
+            **{COL_PLAZO_LIQ: df[COL_PLAZO_LIQ].mask(rows_to_update, PLAZO_LIQ_CERO)}
         )
-        df.loc[rows_to_update, "Plazo Liq._Plazo Liq."] = 0
     return df